@@ -1,8 +1,34 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+import hashlib
+from itertools import islice
+import logging
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
 import re
+import threading
+from typing import Optional, Union
 import uvicorn
 
+try:
+    # Linear-time DFA matching: no backtracking blow-up on long sequences
+    import re2
+except ImportError:
+    re2 = None
+
+try:
+    # Multi-needle literal search: one pass for every fixed-string pattern
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+logger = logging.getLogger(__name__)
+
 app = FastAPI(title="PhazeGEN HGT API", version="1.0.0")
 
 # Enable CORS
@@ -14,46 +40,332 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Database of known patterns for detection
+PATTERNS = {
+    'plasmids': {
+        'IncF': r'ATG[ACGT]{15,}AAA[ACGT]{10,}TAA',
+        'IncI': r'ATG[ACGT]{12,}GGT[ACGT]{8,}TGA',
+        'RepA': r'ATG[ACGT]{18,}CAG[ACGT]{9,}TAA',
+        'ParA': r'ATG[ACGT]{10,}TTC[ACGT]{7,}TAG',
+    },
+    'transposons': {
+        'Tn5': r'ATG[ACGT]{20,}CAT[ACGT]{10,}TAA',
+        'IS3': r'CAGGTA|GTCCAT',
+        'IS5': r'GGTTAC|CCAATG',
+        'Tn3': r'ATG[ACGT]{15,}GGA[ACGT]{8,}TGA',
+    },
+    'resistance': {
+        'blaTEM': r'ATG[ACGT]{30,}S[ACGT]{10,}',
+        'blaCTX-M': r'ATG[ACGT]{28,}CTX[ACGT]{12,}',
+        'tetA': r'ATG[ACGT]{25,}MFS[ACGT]{15,}TAA',
+        'aac': r'ATG[ACGT]{20,}AAC[ACGT]{10,}TGA',
+        'mcr': r'ATG[ACGT]{18,}MCR[ACGT]{12,}TAA',
+    }
+}
+
+# Transposon family per pattern name
+TRANSPOSON_FAMILIES = {
+    'IS3': 'IS3 family',
+    'IS5': 'IS5 family',
+    'Tn5': 'Tn5 family',
+    'Tn3': 'Tn3 family'
+}
+
+# Drug class per resistance gene
+DRUG_CLASSES = {
+    'blaTEM': 'Beta-lactams (Penicillins)',
+    'blaCTX-M': 'Beta-lactams (Cephalosporins)',
+    'tetA': 'Tetracyclines',
+    'aac': 'Aminoglycosides',
+    'mcr': 'Polymyxins (Colistin)'
+}
+
+# Display strings for the per-pattern family and drug class ids; the last
+# entry is the fallback for names missing from the table
+FAMILY_NAMES = list(dict.fromkeys(TRANSPOSON_FAMILIES.values())) + ['Unknown family']
+DRUG_CLASS_NAMES = list(dict.fromkeys(DRUG_CLASSES.values())) + ['Multiple classes']
+
+# Resistance risk flag bits, and the score bonus for every flag combination
+CARBAPENEM_FLAG, COLISTIN_FLAG, CRITICAL_FLAG = 1, 2, 4
+FLAG_BONUSES = [
+    (25 if flags & CARBAPENEM_FLAG else 0)
+    + (30 if flags & COLISTIN_FLAG else 0)
+    + (20 if flags & CRITICAL_FLAG else 0)
+    for flags in range(8)
+]
+
+# Byte tables for cleaning input in one C-level pass: bytes.translate()
+# upper-cases ACGTN, masks every other byte as N, and drops whitespace.
+# Masking keeps positions in place and stops matches running across
+# ambiguity codes or stray characters
+_NUCLEOTIDES = bytes(
+    b if b in b'ACGTN' else b - 32 if b in b'acgtn' else ord('N')
+    for b in range(256)
+)
+_WHITESPACE = b' \t\r\n\v\f'
+_UNMASKED = b'ACGTNacgtn' + _WHITESPACE
+
+# Patterns that are just alternations of fixed strings (e.g. 'CAGGTA|GTCCAT')
+_LITERAL_ALTERNATION = re.compile(r'[ACGT]+(?:\|[ACGT]+)*')
+
+# Patterns that are a plain concatenation of literal runs and (quantified)
+# character classes, e.g. 'ATG[ACGT]{15,}AAA[ACGT]{10,}TAA'
+_ANCHOR_TOKEN = r'[A-Z]+|\[[A-Z]+\](?:\{\d+,?\d*\}|[*+?])?'
+_ANCHORABLE = re.compile(f'(?:{_ANCHOR_TOKEN})+')
+_ANCHOR_TOKENS = re.compile(_ANCHOR_TOKEN)
+
+def _literal_anchors(pattern: str):
+    """Literal runs every match must contain, plus whether the pattern
+    starts and ends with one; None for patterns too complex to reason about"""
+    if not _ANCHORABLE.fullmatch(pattern):
+        return None
+    tokens = _ANCHOR_TOKENS.findall(pattern)
+    runs = [token.encode('ascii') for token in tokens if not token.startswith('[')]
+    return runs, not tokens[0].startswith('['), not tokens[-1].startswith('[')
+
+def _compile_pattern(pattern: str):
+    """Compile a detection pattern for bytes input, with RE2 when available
+
+    Input is upper-cased by the _NUCLEOTIDES table before scanning, so
+    patterns match case-sensitively and the engine never case-folds.
+    """
+    pattern = pattern.encode('ascii')
+    if re2 is not None:
+        return re2.compile(pattern)
+    return re.compile(pattern)
+
+def _kmer_positions(bases: np.ndarray, word: bytes) -> np.ndarray:
+    """Start offsets of every occurrence of a short literal in a uint8 array"""
+    k = len(word)
+    if len(bases) < k:
+        return np.empty(0, dtype=np.intp)
+    
+    # Match the first base over the whole array, then narrow the candidates
+    # one base at a time; each step keeps roughly a quarter of them
+    hits = np.flatnonzero(bases[:len(bases) - k + 1] == word[0])
+    for offset in range(1, k):
+        hits = hits[bases[hits + offset] == word[offset]]
+    return hits
+
+def iter_fasta(buf: bytes, default_id: str = "unknown"):
+    """Yield (record_id, sequence) pairs from FASTA bytes
+
+    Header lines and line breaks are dropped so only sequence bytes reach
+    the scanner; content without a '>' header is treated as one record.
+    """
+    buf = buf.lstrip()
+    if not buf.startswith(b'>'):
+        yield default_id, buf.translate(None, b'\r\n \t')
+        return
+    
+    for record in buf[1:].split(b'\n>'):
+        header, _, body = record.partition(b'\n')
+        yield header.strip().decode('utf-8', 'replace'), body.translate(None, b'\r\n \t')
+
+# Sequences at least this long have their categories scanned in parallel
+# worker processes; below it, process hand-off costs more than it saves
+PARALLEL_SCAN_THRESHOLD = 4 << 20
+
+@dataclass
+class Detections:
+    """Scan hits as parallel arrays (one entry per match) rather than dicts"""
+    pattern_ids: np.ndarray
+    starts: np.ndarray
+    ends: np.ndarray
+    
+    def __len__(self):
+        return len(self.pattern_ids)
+    
+    def capped(self, limit: int):
+        """The first ``limit`` hits of each pattern, and the ids of the patterns
+        that had more; each pattern's hits are contiguous, as the scan emits them"""
+        ids = self.pattern_ids
+        firsts = np.flatnonzero(np.diff(ids, prepend=-1))
+        ranks = np.arange(len(ids)) - np.repeat(firsts, np.diff(firsts, append=len(ids)))
+        keep = ranks < limit
+        return (
+            Detections(ids[keep], self.starts[keep], self.ends[keep]),
+            np.unique(ids[~keep])
+        )
+
 class HGTRiskAnalyzer:
     """Complete HGT analyzer built-in - no external services needed"""
     
-    def __init__(self):
-        # Database of known patterns for detection
+    def __init__(self, cache_size: int = 1024, max_matches_per_pattern: Optional[int] = None,
+                 parallel_threshold: Optional[int] = PARALLEL_SCAN_THRESHOLD):
+        # Compile the detection patterns once so requests don't pay for
+        # re's compile/cache lookup on every scan
         self.patterns = {
-            'plasmids': {
-                'IncF': r'ATG[ACGT]{15,}AAA[ACGT]{10,}TAA',
-                'IncI': r'ATG[ACGT]{12,}GGT[ACGT]{8,}TGA',
-                'RepA': r'ATG[ACGT]{18,}CAG[ACGT]{9,}TAA',
-                'ParA': r'ATG[ACGT]{10,}TTC[ACGT]{7,}TAG',
-            },
-            'transposons': {
-                'Tn5': r'ATG[ACGT]{20,}CAT[ACGT]{10,}TAA',
-                'IS3': r'CAGGTA|GTCCAT',
-                'IS5': r'GGTTAC|CCAATG',
-                'Tn3': r'ATG[ACGT]{15,}GGA[ACGT]{8,}TGA',
-            },
-            'resistance': {
-                'blaTEM': r'ATG[ACGT]{30,}S[ACGT]{10,}',
-                'blaCTX-M': r'ATG[ACGT]{28,}CTX[ACGT]{12,}',
-                'tetA': r'ATG[ACGT]{25,}MFS[ACGT]{15,}TAA',
-                'aac': r'ATG[ACGT]{20,}AAC[ACGT]{10,}TGA',
-                'mcr': r'ATG[ACGT]{18,}MCR[ACGT]{12,}TAA',
-            }
+            category: {name: _compile_pattern(pattern) for name, pattern in patterns.items()}
+            for category, patterns in PATTERNS.items()
         }
         
+        # Integer pattern ids in PATTERNS order: the scan kernel deals only in
+        # (pattern_id, start, end) and names are resolved when building results
+        self.pattern_keys = [
+            (category, name) for category, patterns in PATTERNS.items() for name in patterns
+        ]
+        self.compiled = [self.patterns[category][name] for category, name in self.pattern_keys]
+        
         # High-risk plasmid types
         self.high_risk_plasmids = ['IncF', 'IncI', 'IncA/C', 'IncX']
         
         # Critical resistance genes
         self.critical_genes = ['blaCTX-M', 'mcr', 'KPC', 'NDM']
+        
+        # Per-pattern attributes indexed by pattern id, so classifying a hit
+        # is an array lookup instead of list membership and dict lookups
+        self.is_high_risk = np.array(
+            [category == 'plasmids' and name in self.high_risk_plasmids for category, name in self.pattern_keys],
+            dtype=np.int8
+        )
+        self.is_critical = np.array(
+            [category == 'resistance' and name in self.critical_genes for category, name in self.pattern_keys],
+            dtype=np.int8
+        )
+        self.drug_class_id = np.array(
+            [DRUG_CLASS_NAMES.index(DRUG_CLASSES.get(name, DRUG_CLASS_NAMES[-1])) for _, name in self.pattern_keys],
+            dtype=np.int8
+        )
+        self.family_id = np.array(
+            [FAMILY_NAMES.index(TRANSPOSON_FAMILIES.get(name, FAMILY_NAMES[-1])) for _, name in self.pattern_keys],
+            dtype=np.int8
+        )
+        
+        # Drug class keywords are matched once here, so neither scoring nor
+        # recommendations do string work per hit
+        drug_classes = [name.lower() for name in DRUG_CLASS_NAMES]
+        self.risk_flags = (
+            np.array(['carbapenem' in drug_classes[i] for i in self.drug_class_id.tolist()], dtype=np.uint8) * CARBAPENEM_FLAG
+            | np.array(['colistin' in drug_classes[i] for i in self.drug_class_id.tolist()], dtype=np.uint8) * COLISTIN_FLAG
+            | self.is_critical.astype(np.uint8) * CRITICAL_FLAG
+        )
+        
+        # Full score contribution of one hit, per pattern id, so scoring is a
+        # single gather-and-sum over the detections
+        self.score_lut = np.array(
+            [self._pattern_points(pattern_id) for pattern_id in range(len(self.pattern_keys))],
+            dtype=np.int32
+        )
+        
+        # Per-category result list and builder turning a match span into an entry
+        self.element_builders = {
+            'plasmids': ('plasmids', self._plasmid_element),
+            'transposons': ('transposons', self._transposon_element),
+            'resistance': ('resistance_genes', self._resistance_element),
+        }
+        
+        # Fixed-literal patterns skip the regex engine: they are found by a
+        # single Aho-Corasick automaton over all categories, or by vectorized
+        # NumPy k-mer matching when pyahocorasick is not installed
+        self.literals = {
+            (category, name): [word.encode('ascii') for word in pattern.split('|')]
+            for category, patterns in PATTERNS.items()
+            for name, pattern in patterns.items()
+            if _LITERAL_ALTERNATION.fullmatch(pattern)
+        }
+        self.literal_keys = set(self.literals)
+        self.automaton = None
+        if ahocorasick is not None:
+            self.automaton = ahocorasick.Automaton()
+            for key, words in self.literals.items():
+                for alternative, word in enumerate(words):
+                    word = word.decode('ascii')
+                    if word not in self.automaton:
+                        self.automaton.add_word(word, [])
+                    self.automaton.get(word).append((key, alternative, len(word)))
+            self.automaton.make_automaton()
+        
+        # Literal anchors of the regex patterns, used to prefilter scans with
+        # bytes.find. A literal that can't occur in cleaned (ACGTN) input,
+        # like 'MFS' or 'CTX', means the pattern can never match at all.
+        self.anchors = {}
+        self.inactive_keys = set()
+        for category, name in self.pattern_keys:
+            if (category, name) in self.literal_keys:
+                continue
+            anchors = _literal_anchors(PATTERNS[category][name])
+            if anchors is None:
+                continue
+            impossible = [run for run in anchors[0] if run.translate(None, b'ACGTN')]
+            if impossible:
+                logger.warning(
+                    "Pattern %s/%s requires %s, which never occurs in a DNA sequence; it will never match",
+                    category, name, ', '.join(run.decode() for run in impossible)
+                )
+                self.inactive_keys.add((category, name))
+            else:
+                self.anchors[(category, name)] = anchors
+        
+        # LRU of analysis results keyed by sequence digest, so re-submitted
+        # sequences (retries, duplicate uploads) skip the scan entirely
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        
+        # Default cap on hits per pattern (None = unlimited); bounds the work
+        # adversarial, match-dense input can cause
+        self.max_matches_per_pattern = max_matches_per_pattern
+        
+        # Worker pool for scanning long sequences one category per process,
+        # started on first use (None threshold = always scan in-process)
+        self.parallel_threshold = parallel_threshold
+        self._pool = None
+        self._pool_lock = threading.Lock()
     
-    def analyze_sequence(self, sequence: str, filename: str = "unknown"):
+    def analyze_sequence(self, sequence: Union[str, bytes], filename: str = "unknown",
+                         max_matches_per_pattern: Optional[int] = None):
         """Main analysis function"""
-        sequence = sequence.upper()
+        # DNA is ASCII: scan bytes rather than str to halve memory and
+        # keep the regex engine on its byte fast path
+        if isinstance(sequence, str):
+            sequence = sequence.encode('ascii', 'replace')
+        masked = len(sequence.translate(None, _UNMASKED))
+        sequence = sequence.translate(_NUCLEOTIDES, _WHITESPACE)
+        
+        if max_matches_per_pattern is None:
+            max_matches_per_pattern = self.max_matches_per_pattern
+        
+        # The filename only labels the sample, so it stays out of the cache
+        analysis = self._analyze_cached(sequence, max_matches_per_pattern)
+        results = {'sample_id': filename, **analysis}
+        results['warnings'] = list(analysis['warnings'])
+        
+        if masked:
+            results['warnings'].insert(
+                0, f"Masked {masked} non-nucleotide characters as N"
+            )
         
+        return results
+    
+    def _analyze_cached(self, sequence: bytes, max_matches: Optional[int]):
+        """Return the cached analysis of a cleaned sequence, running it on a miss"""
+        digest = hashlib.blake2b(sequence, digest_size=16).digest()
+        key = (digest, max_matches)
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+        
+        results = self._analyze(sequence, max_matches)
+        
+        # The same digest gives a stable ID (unlike hash(), which is salted
+        # per process), so one hash pass serves both the cache and the ID
+        results['analysis_id'] = 'HGT' + digest[:4].hex().upper()
+        
+        if 'error' not in results:
+            with self._cache_lock:
+                self._cache[key] = results
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        
+        return results
+    
+    def _analyze(self, sequence: bytes, max_matches: Optional[int] = None):
+        """Run detection and scoring on a cleaned sequence"""
         # Initialize results
         results = {
-            'sample_id': filename,
             'sequence_length': len(sequence),
             'risk_score': 0,
             'risk_level': 'Minimal',
@@ -68,20 +380,30 @@ class HGTRiskAnalyzer:
         }
         
         try:
-            # Detect all elements
-            results['detected_elements']['plasmids'] = self._detect_plasmids(sequence)
-            results['detected_elements']['transposons'] = self._detect_transposons(sequence)
-            results['detected_elements']['resistance_genes'] = self._detect_resistance(sequence)
+            # Detect all elements. Scanning one hit past the cap tells a
+            # pattern that was cut short from one with exactly that many hits
+            if max_matches is None:
+                detections = self._scan_sequence(sequence, None)
+            else:
+                detections, truncated = self._scan_sequence(sequence, max_matches + 1).capped(max_matches)
+            results['detected_elements'].update(self._build_elements(sequence, detections))
+            
+            if max_matches is not None:
+                for pattern_id in truncated.tolist():
+                    results['warnings'].append(
+                        f"Match limit ({max_matches}) reached for "
+                        f"{self.pattern_keys[pattern_id][1]}; further hits were skipped"
+                    )
             
             # Calculate risk score
-            results['risk_score'] = self._calculate_risk_score(results['detected_elements'])
+            results['risk_score'] = self._calculate_risk_score(detections)
             results['risk_level'] = self._determine_risk_level(results['risk_score'])
             
             # Generate recommendations
-            results['recommendations'] = self._generate_recommendations(results)
+            results['recommendations'] = self._generate_recommendations(results, detections)
             
             # Add summary
-            results['summary'] = self._create_summary(results)
+            results['summary'] = self._create_summary(results, detections)
             
         except Exception as e:
             results['error'] = str(e)
@@ -89,85 +411,232 @@ class HGTRiskAnalyzer:
         
         return results
     
-    def _detect_plasmids(self, sequence: str):
-        """Detect plasmid signatures"""
-        plasmids = []
-        
-        for name, pattern in self.patterns['plasmids'].items():
-            matches = list(re.finditer(pattern, sequence, re.IGNORECASE))
-            for match in matches:
-                plasmids.append({
-                    'replicon': name,
-                    'position': f"{match.start()}-{match.end()}",
-                    'confidence': min(0.8 + (len(match.group()) / 200), 0.95),
-                    'sequence': match.group()[:30] + '...' if len(match.group()) > 30 else match.group(),
-                    'risk_category': 'High' if name in self.high_risk_plasmids else 'Medium'
-                })
-        
-        return plasmids
+    def _scan_literals(self, sequence: bytes, max_matches: Optional[int] = None):
+        """Find every fixed-literal pattern hit without going through regex"""
+        hits = {}
+        if self.automaton is not None:
+            for end, entries in self.automaton.iter(str(sequence, 'ascii')):
+                for key, alternative, length in entries:
+                    hits.setdefault(key, []).append((end - length + 1, alternative, length))
+        else:
+            bases = np.frombuffer(sequence, dtype=np.uint8)
+            for key, words in self.literals.items():
+                found = hits.setdefault(key, [])
+                for alternative, word in enumerate(words):
+                    found.extend(
+                        (start, alternative, len(word))
+                        for start in _kmer_positions(bases, word).tolist()
+                    )
+        
+        # Both searches report overlapping hits; keep the leftmost-first,
+        # non-overlapping ones that finditer would have returned
+        spans = {}
+        for key, found in hits.items():
+            found.sort()
+            kept = spans[key] = []
+            last_end = 0
+            for start, _, length in found:
+                if start >= last_end:
+                    last_end = start + length
+                    kept.append((start, last_end))
+                    if len(kept) == max_matches:
+                        break
+        
+        return spans
     
-    def _detect_transposons(self, sequence: str):
-        """Detect transposons and IS elements"""
-        transposons = []
-        
-        for name, pattern in self.patterns['transposons'].items():
-            matches = list(re.finditer(pattern, sequence, re.IGNORECASE))
-            for match in matches:
-                transposons.append({
-                    'name': name,
-                    'type': 'Insertion Sequence' if name.startswith('IS') else 'Transposon',
-                    'position': f"{match.start()}-{match.end()}",
-                    'confidence': min(0.75 + (len(match.group()) / 150), 0.92),
-                    'family': self._classify_transposon_family(name)
-                })
-        
-        return transposons
+    def _scan_sequence(self, sequence: bytes, max_matches: Optional[int]) -> Detections:
+        """Scan in-process, or across the worker pool for long sequences"""
+        if self.parallel_threshold is None or len(sequence) < self.parallel_threshold:
+            return self._scan(sequence, max_matches)
+        
+        try:
+            return self._scan_parallel(sequence, max_matches)
+        except BrokenProcessPool:
+            # A worker died; drop the pool so the next long sequence
+            # starts a fresh one
+            with self._pool_lock:
+                if self._pool is not None:
+                    self._pool.shutdown(wait=False, cancel_futures=True)
+                    self._pool = None
+            return self._scan(sequence, max_matches)
+        except OSError:
+            # No usable pool or shared memory on this host
+            return self._scan(sequence, max_matches)
     
-    def _detect_resistance(self, sequence: str):
-        """Detect antibiotic resistance genes"""
-        resistance_genes = []
-        
-        for name, pattern in self.patterns['resistance'].items():
-            matches = list(re.finditer(pattern, sequence, re.IGNORECASE))
-            for match in matches:
-                gene = {
-                    'gene': name,
-                    'position': f"{match.start()}-{match.end()}",
-                    'confidence': min(0.85 + (len(match.group()) / 180), 0.98),
-                    'drug_class': self._get_drug_class(name),
-                    'risk_level': 'Critical' if name in self.critical_genes else 'High'
-                }
-                resistance_genes.append(gene)
-        
-        return resistance_genes
+    def _scan_parallel(self, sequence: bytes, max_matches: Optional[int]) -> Detections:
+        """Fan the categories out to worker processes over shared memory"""
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=len(PATTERNS),
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_scan_worker
+                )
+            pool = self._pool
+        
+        # Workers map the sequence from shared memory instead of having
+        # it pickled through the task queue
+        shm = SharedMemory(create=True, size=max(len(sequence), 1))
+        try:
+            shm.buf[:len(sequence)] = sequence
+            # The anchor windows need bytes.find, so they are worked out
+            # here and workers scan the shared buffer without copying it
+            futures = [
+                pool.submit(
+                    _scan_category, shm.name, len(sequence), category, max_matches,
+                    {key: self._scan_window(key, sequence) for key in self.pattern_keys if key[0] == category}
+                )
+                for category in PATTERNS
+            ]
+            # Pattern ids are grouped by category, so concatenating the parts
+            # in category order keeps the serial scan's ordering
+            parts = [future.result() for future in futures]
+        finally:
+            shm.close()
+            shm.unlink()
+        
+        return Detections(
+            np.concatenate([part.pattern_ids for part in parts]),
+            np.concatenate([part.starts for part in parts]),
+            np.concatenate([part.ends for part in parts])
+        )
     
-    def _calculate_risk_score(self, elements: dict) -> int:
-        """Calculate HGT risk score (0-100)"""
-        score = 0
+    def _scan(self, sequence: bytes, max_matches: Optional[int] = None,
+              category: Optional[str] = None, windows: Optional[dict] = None) -> Detections:
+        """Scan kernel: every hit as (pattern_id, start, end) arrays, in pattern order
+
+        finditer is consumed lazily, so a ``max_matches`` cap stops each
+        pattern's scan early instead of trimming a fully built match list.
+        Passing ``category`` restricts the scan to that category's patterns;
+        ``windows`` supplies precomputed _scan_window results, which lets
+        ``sequence`` be any buffer rather than bytes.
+        """
+        selected = [key for key in self.pattern_keys if category in (None, key[0])]
+        literal_hits = {}
+        if self.literal_keys.intersection(selected):
+            literal_hits = self._scan_literals(sequence, max_matches)
+        pattern_ids, spans = [], []
+        
+        # One scan per pattern: fusing a category into a single alternation
+        # would let a greedy pattern consume the spans its siblings match.
+        # Per match the only Python-level work is one span() call.
+        for pattern_id, (key, pattern) in enumerate(zip(self.pattern_keys, self.compiled)):
+            if category is not None and key[0] != category:
+                continue
+            if key in self.literal_keys:
+                found = literal_hits.get(key, [])
+            else:
+                window = windows[key] if windows is not None else self._scan_window(key, sequence)
+                if window is None:
+                    found = []
+                else:
+                    found = [match.span() for match in islice(pattern.finditer(sequence, *window), max_matches)]
+            if found:
+                pattern_ids.append(np.full(len(found), pattern_id, dtype=np.int16))
+                spans.append(np.array(found, dtype=np.int64))
+        
+        if not spans:
+            empty = np.empty(0, dtype=np.int64)
+            return Detections(np.empty(0, dtype=np.int16), empty, empty)
+        
+        spans = np.concatenate(spans)
+        return Detections(np.concatenate(pattern_ids), spans[:, 0], spans[:, 1])
+    
+    def _scan_window(self, key, sequence: bytes):
+        """(pos, endpos) slice a regex pattern can match in, or None if it can't match"""
+        if key in self.inactive_keys:
+            return None
+        anchors = self.anchors.get(key)
+        if anchors is None:
+            return 0, len(sequence)
+        
+        # Matches start at an occurrence of a leading literal and end after
+        # one of a trailing literal, so the regex only has to sweep from the
+        # first of the former to the last of the latter
+        runs, anchored_start, anchored_end = anchors
+        start, end = 0, len(sequence)
+        if anchored_start:
+            start = sequence.find(runs[0])
+            if start < 0:
+                return None
+        if anchored_end:
+            end = sequence.rfind(runs[-1])
+            if end < start:
+                return None
+            end += len(runs[-1])
+        
+        for run in runs:
+            if sequence.find(run, start, end) < 0:
+                return None
+        return start, end
+    
+    def _build_elements(self, sequence: bytes, detections: Detections):
+        """Materialize the per-category result entries for the JSON response"""
+        elements = {field: [] for field, _ in self.element_builders.values()}
+        hits = zip(
+            detections.pattern_ids.tolist(), detections.starts.tolist(), detections.ends.tolist()
+        )
+        for pattern_id, start, end in hits:
+            category, name = self.pattern_keys[pattern_id]
+            field, build = self.element_builders[category]
+            elements[field].append(build(pattern_id, name, sequence, start, end))
+        return elements
+    
+    def _plasmid_element(self, pattern_id: int, name: str, sequence: bytes, start: int, end: int):
+        """Build a plasmid signature hit"""
+        length = end - start
+        return {
+            'replicon': name,
+            'position': f"{start}-{end}",
+            'confidence': min(0.8 + (length / 200), 0.95),
+            'sequence': sequence[start:start + 30].decode() + '...' if length > 30 else sequence[start:end].decode(),
+            'risk_category': 'High' if self.is_high_risk[pattern_id] else 'Medium'
+        }
+    
+    def _transposon_element(self, pattern_id: int, name: str, sequence: bytes, start: int, end: int):
+        """Build a transposon / IS element hit"""
+        return {
+            'name': name,
+            'type': 'Insertion Sequence' if name.startswith('IS') else 'Transposon',
+            'position': f"{start}-{end}",
+            'confidence': min(0.75 + ((end - start) / 150), 0.92),
+            'family': FAMILY_NAMES[self.family_id[pattern_id]]
+        }
+    
+    def _resistance_element(self, pattern_id: int, name: str, sequence: bytes, start: int, end: int):
+        """Build an antibiotic resistance gene hit"""
+        return {
+            'gene': name,
+            'position': f"{start}-{end}",
+            'confidence': min(0.85 + ((end - start) / 180), 0.98),
+            'drug_class': DRUG_CLASS_NAMES[self.drug_class_id[pattern_id]],
+            'risk_level': 'Critical' if self.is_critical[pattern_id] else 'High'
+        }
+    
+    def _pattern_points(self, pattern_id: int) -> int:
+        """Risk points contributed by one hit of a pattern"""
+        category, name = self.pattern_keys[pattern_id]
         
         # Plasmid scoring
-        for plasmid in elements.get('plasmids', []):
-            score += 10
-            if plasmid.get('risk_category') == 'High':
-                score += 15
-            if plasmid.get('replicon', '').startswith('Inc'):
-                score += 5
+        if category == 'plasmids':
+            points = 10
+            if self.is_high_risk[pattern_id]:
+                points += 15
+            if name.startswith('Inc'):
+                points += 5
+            return points
         
         # Transposon scoring
-        score += len(elements.get('transposons', [])) * 8
+        if category == 'transposons':
+            return 8
         
         # Resistance gene scoring
-        for gene in elements.get('resistance_genes', []):
-            score += 15
-            if gene.get('risk_level') == 'Critical':
-                score += 20
-            if 'carbapenem' in gene.get('drug_class', '').lower():
-                score += 25
-            if 'colistin' in gene.get('drug_class', '').lower():
-                score += 30
-        
+        return 15 + FLAG_BONUSES[self.risk_flags[pattern_id]]
+    
+    def _calculate_risk_score(self, detections: Detections) -> int:
+        """Calculate HGT risk score (0-100)"""
         # Cap at 100
-        return min(score, 100)
+        return int(min(self.score_lut[detections.pattern_ids].sum(), 100))
     
     def _determine_risk_level(self, score: int) -> str:
         if score >= 75:
@@ -181,7 +650,7 @@ class HGTRiskAnalyzer:
         else:
             return '⚪ MINIMAL'
     
-    def _generate_recommendations(self, results: dict):
+    def _generate_recommendations(self, results: dict, detections: Detections):
         """Generate actionable recommendations"""
         recommendations = []
         
@@ -190,7 +659,9 @@ class HGTRiskAnalyzer:
             recommendations.append("📋 Implement infection control measures")
             recommendations.append("🌍 Report to surveillance authorities")
         
-        if any(gene['risk_level'] == 'Critical' for gene in results['detected_elements'].get('resistance_genes', [])):
+        flags = np.bitwise_or.reduce(self.risk_flags[detections.pattern_ids], initial=0)
+        
+        if flags & CRITICAL_FLAG:
             recommendations.append("💊 Critical resistance detected - review treatment protocols")
         
         if len(results['detected_elements'].get('plasmids', [])) > 0:
@@ -207,41 +678,48 @@ class HGTRiskAnalyzer:
         
         return recommendations
     
-    def _create_summary(self, results: dict):
+    def _create_summary(self, results: dict, detections: Detections):
         """Create analysis summary"""
         return {
             'total_elements': sum(len(v) for v in results['detected_elements'].values()),
             'plasmid_count': len(results['detected_elements']['plasmids']),
             'transposon_count': len(results['detected_elements']['transposons']),
             'resistance_count': len(results['detected_elements']['resistance_genes']),
-            'high_risk_plasmids': len([p for p in results['detected_elements']['plasmids'] 
-                                      if p.get('risk_category') == 'High'])
-        }
-    
-    def _classify_transposon_family(self, name: str) -> str:
-        """Classify transposon family"""
-        families = {
-            'IS3': 'IS3 family',
-            'IS5': 'IS5 family', 
-            'Tn5': 'Tn5 family',
-            'Tn3': 'Tn3 family'
+            'high_risk_plasmids': int(self.is_high_risk[detections.pattern_ids].sum())
         }
-        return families.get(name, 'Unknown family')
-    
-    def _get_drug_class(self, gene_name: str) -> str:
-        """Get drug class for resistance gene"""
-        classes = {
-            'blaTEM': 'Beta-lactams (Penicillins)',
-            'blaCTX-M': 'Beta-lactams (Cephalosporins)',
-            'tetA': 'Tetracyclines',
-            'aac': 'Aminoglycosides',
-            'mcr': 'Polymyxins (Colistin)'
-        }
-        return classes.get(gene_name, 'Multiple classes')
+
+# Per-process analyzer used by the parallel scan workers
+_worker_analyzer = None
+
+def _init_scan_worker():
+    """Pool initializer: compile the patterns once per worker process"""
+    global _worker_analyzer
+    _worker_analyzer = HGTRiskAnalyzer(cache_size=0, parallel_threshold=None)
+
+def _scan_category(shm_name: str, length: int, category: str, max_matches: Optional[int],
+                   windows: dict) -> Detections:
+    """Worker task: scan one category of a sequence held in shared memory"""
+    shm = SharedMemory(name=shm_name)
+    try:
+        # Scan the shared pages in place; only the Aho-Corasick literal
+        # search makes a (str) copy
+        with shm.buf[:length] as view:
+            return _worker_analyzer._scan(view, max_matches, category, windows)
+    finally:
+        shm.close()
 
 # Create analyzer instance
 analyzer = HGTRiskAnalyzer()
 
+def _max_matches_param(request_data: dict) -> Optional[int]:
+    """Read the optional per-request match cap"""
+    max_matches = request_data.get("max_matches_per_pattern")
+    if max_matches is None:
+        return None
+    if not isinstance(max_matches, int) or isinstance(max_matches, bool) or max_matches < 1:
+        raise HTTPException(status_code=400, detail="max_matches_per_pattern must be a positive integer")
+    return max_matches
+
 # API Routes
 @app.get("/")
 def root():
@@ -277,6 +755,7 @@ def analyze_sequence(request_data: dict):
     try:
         sequence = request_data.get("sequence", "")
         filename = request_data.get("filename", "unknown.fasta")
+        max_matches = _max_matches_param(request_data)
         
         if not sequence:
             raise HTTPException(status_code=400, detail="No sequence provided")
@@ -285,10 +764,9 @@ def analyze_sequence(request_data: dict):
             raise HTTPException(status_code=400, detail="Sequence too short (minimum 20 characters)")
         
         # Analyze sequence
-        results = analyzer.analyze_sequence(sequence, filename)
+        results = analyzer.analyze_sequence(sequence, filename, max_matches)
         
         # Add metadata
-        results['analysis_id'] = f"HGT{hash(sequence) % 1000000:06d}"
         results['timestamp'] = "2024-01-01T00:00:00Z"  # In production, use datetime
         
         return results
@@ -299,25 +777,32 @@ def analyze_sequence(request_data: dict):
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
 @app.post("/api/analyze/file")
-async def analyze_file(request_data: dict):
+def analyze_file(request_data: dict):
     """Analyze uploaded file (simplified - accepts base64 or direct text)"""
     try:
         # For simplicity, we accept the file content directly
         file_content = request_data.get("content", "")
         filename = request_data.get("filename", "uploaded.fasta")
+        max_matches = _max_matches_param(request_data)
         
         if not file_content:
             raise HTTPException(status_code=400, detail="No file content provided")
         
-        # Analyze the content
-        results = analyzer.analyze_sequence(file_content, filename)
+        # Analyze each FASTA record on its own sequence bytes
+        results = [
+            analyzer.analyze_sequence(sequence, record_id, max_matches)
+            for record_id, sequence in iter_fasta(file_content.encode('utf-8'), filename)
+        ]
         
         return {
             "status": "success",
             "filename": filename,
+            "record_count": len(results),
             "results": results
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"File analysis failed: {str(e)}")
 
@@ -325,11 +810,12 @@ async def analyze_file(request_data: dict):
 def get_patterns():
     """Get the detection patterns being used"""
     return {
-        "plasmid_patterns": list(analyzer.patterns['plasmids'].keys()),
-        "transposon_patterns": list(analyzer.patterns['transposons'].keys()),
-        "resistance_patterns": list(analyzer.patterns['resistance'].keys()),
+        "plasmid_patterns": list(PATTERNS['plasmids'].keys()),
+        "transposon_patterns": list(PATTERNS['transposons'].keys()),
+        "resistance_patterns": list(PATTERNS['resistance'].keys()),
         "high_risk_plasmids": analyzer.high_risk_plasmids,
-        "critical_genes": analyzer.critical_genes
+        "critical_genes": analyzer.critical_genes,
+        "inactive_patterns": sorted(name for _, name in analyzer.inactive_keys)
     }
 
 if __name__ == "__main__":
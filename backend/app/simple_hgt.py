@@ -2,13 +2,21 @@ import re
 import json
 import tempfile
 import os
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from itertools import islice
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Dict, Optional
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from typing import List, Dict, Optional, Union
 import uvicorn
 from datetime import datetime
 
+try:
+    # Linear-time DFA matching: no backtracking blow-up on long sequences
+    import re2
+except ImportError:
+    re2 = None
+
 app = FastAPI(title="PhazeGEN HGT API - Simplified")
 
 app.add_middleware(
@@ -22,47 +30,111 @@ app.add_middleware(
 class AnalysisRequest(BaseModel):
     sequence: str
     filename: str = "unknown"
+    max_matches_per_pattern: Optional[int] = Field(None, gt=0)
+
+# Pre-defined patterns for demonstration
+PATTERNS = {
+    'plasmids': {
+        'IncF': r'ATG[ACGT]{15,}AAA[ACGT]{10,}TAA',
+        'IncI': r'ATG[ACGT]{12,}GGT[ACGT]{8,}TGA',
+        'repA': r'ATG[ACGT]{18,}CAG[ACGT]{9,}TAA',
+        'parA': r'ATG[ACGT]{10,}TTC[ACGT]{7,}TAG',
+    },
+    'transposons': {
+        'tnpA': r'ATG[ACGT]{20,}CAT[ACGT]{10,}TAA',
+        'IS3': r'CAGGTA|GTCCAT',
+        'IS5': r'GGTTAC|CCAATG',
+        'tnpR': r'ATG[ACGT]{15,}GGA[ACGT]{8,}TGA',
+    },
+    'resistance': {
+        'blaTEM': r'ATG[ACGT]{30,}S[ACGT]{10,}ESBL',
+        'tetA': r'ATG[ACGT]{25,}MFS[ACGT]{15,}TAA',
+        'aac': r'ATG[ACGT]{20,}AAC[ACGT]{10,}TGA',
+        'mcr': r'ATG[ACGT]{18,}MCR[ACGT]{12,}TAA',
+    }
+}
+
+# Risk points per detection type, plus the bonus for the highest-risk
+# names of each type, looked up once per detection
+RISK_POINTS = {'plasmid': 15, 'transposon': 10, 'resistance': 20}
+RISK_BONUSES = {'IncF': 10, 'IncI': 10, 'tnpA': 5, 'tnpR': 5, 'blaTEM': 15, 'mcr': 15}
+
+# Byte tables for cleaning input in one C-level pass: bytes.translate()
+# upper-cases ACGTN, masks every other byte as N, and drops whitespace.
+# Masking keeps positions in place and stops matches running across
+# ambiguity codes or stray characters
+_NUCLEOTIDES = bytes(
+    b if b in b'ACGTN' else b - 32 if b in b'acgtn' else ord('N')
+    for b in range(256)
+)
+_WHITESPACE = b' \t\r\n\v\f'
+
+def _compile_pattern(pattern: str):
+    """Compile a detection pattern for bytes input, with RE2 when available
+
+    Input is upper-cased by the _NUCLEOTIDES table before scanning, so
+    patterns match case-sensitively and the engine never case-folds.
+    """
+    pattern = pattern.encode('ascii')
+    if re2 is not None:
+        return re2.compile(pattern)
+    return re.compile(pattern)
+
+# Upload read size; each chunk is cleaned as it arrives so the raw file is
+# never held in memory alongside the sequence
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+async def read_sequence(file: UploadFile) -> bytearray:
+    """Stream an upload into a cleaned nucleotide buffer, skipping FASTA headers"""
+    sequence = bytearray()
+    in_header = False
+    
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        pos = 0
+        while pos < len(chunk):
+            if in_header:
+                # Header lines may straddle chunks; resume at the next newline
+                newline = chunk.find(b'\n', pos)
+                if newline < 0:
+                    break
+                pos = newline + 1
+                in_header = False
+            else:
+                header = chunk.find(b'>', pos)
+                end = len(chunk) if header < 0 else header
+                sequence += chunk[pos:end].translate(_NUCLEOTIDES, _WHITESPACE)
+                pos = end
+                in_header = header >= 0
+    
+    return sequence
 
 class SimplifiedHGTAnalyzer:
     def __init__(self):
-        # Pre-defined patterns for demonstration
+        # Compile once at startup instead of on every analyze() call
         self.patterns = {
-            'plasmids': {
-                'IncF': r'ATG[ACGT]{15,}AAA[ACGT]{10,}TAA',
-                'IncI': r'ATG[ACGT]{12,}GGT[ACGT]{8,}TGA',
-                'repA': r'ATG[ACGT]{18,}CAG[ACGT]{9,}TAA',
-                'parA': r'ATG[ACGT]{10,}TTC[ACGT]{7,}TAG',
-            },
-            'transposons': {
-                'tnpA': r'ATG[ACGT]{20,}CAT[ACGT]{10,}TAA',
-                'IS3': r'CAGGTA|GTCCAT',
-                'IS5': r'GGTTAC|CCAATG',
-                'tnpR': r'ATG[ACGT]{15,}GGA[ACGT]{8,}TGA',
-            },
-            'resistance': {
-                'blaTEM': r'ATG[ACGT]{30,}S[ACGT]{10,}ESBL',
-                'tetA': r'ATG[ACGT]{25,}MFS[ACGT]{15,}TAA',
-                'aac': r'ATG[ACGT]{20,}AAC[ACGT]{10,}TGA',
-                'mcr': r'ATG[ACGT]{18,}MCR[ACGT]{12,}TAA',
-            }
+            category: {name: _compile_pattern(pattern) for name, pattern in patterns.items()}
+            for category, patterns in PATTERNS.items()
         }
     
-    def analyze(self, sequence: str) -> Dict:
-        sequence = sequence.upper()
+    def analyze(self, sequence: Union[str, bytes, bytearray], max_matches_per_pattern: Optional[int] = None) -> Dict:
+        # Scan ASCII bytes, not str - half the memory, byte fast path in the regex engine.
+        # Byte buffers come from read_sequence() and are already cleaned.
+        if isinstance(sequence, str):
+            sequence = sequence.encode('ascii', 'replace').translate(_NUCLEOTIDES, _WHITESPACE)
         detections = []
         
         for category, patterns in self.patterns.items():
             for name, pattern in patterns.items():
-                matches = list(re.finditer(pattern, sequence, re.IGNORECASE))
-                if matches:
-                    for match in matches:
-                        detections.append({
-                            'type': category[:-1] if category.endswith('s') else category,
-                            'name': name,
-                            'position': f"{match.start()}-{match.end()}",
-                            'confidence': min(0.7 + (len(match.group()) / 100), 0.95),
-                            'sequence': match.group()[:50] + '...' if len(match.group()) > 50 else match.group()
-                        })
+                # Stream matches rather than listing them all up front, stopping
+                # at the optional per-pattern cap
+                for match in islice(pattern.finditer(sequence), max_matches_per_pattern):
+                    detections.append({
+                        'type': category[:-1] if category.endswith('s') else category,
+                        'name': name,
+                        'position': f"{match.start()}-{match.end()}",
+                        'confidence': min(0.7 + (len(match.group()) / 100), 0.95),
+                        'sequence': match.group()[:50].decode() + '...' if len(match.group()) > 50 else match.group().decode()
+                    })
         
         # Calculate risk score
         risk_score = self.calculate_risk(detections)
@@ -83,22 +155,10 @@ class SimplifiedHGTAnalyzer:
         }
     
     def calculate_risk(self, detections: List[Dict]) -> int:
+        points, bonuses = RISK_POINTS, RISK_BONUSES
         score = 0
         for d in detections:
-            if d['type'] == 'plasmid':
-                score += 15
-                if d['name'] in ['IncF', 'IncI']:
-                    score += 10
-            elif d['type'] == 'transposon':
-                score += 10
-                if d['name'] in ['tnpA', 'tnpR']:
-                    score += 5
-            elif d['type'] == 'resistance':
-                score += 20
-                if d['name'] in ['blaTEM', 'mcr']:
-                    score += 15
-            
-            score += int(d['confidence'] * 10)
+            score += points[d['type']] + bonuses.get(d['name'], 0) + int(d['confidence'] * 10)
         
         return min(score, 100)
     
@@ -146,7 +206,9 @@ async def analyze_sequence(request: AnalysisRequest):
         if len(request.sequence) < 20:
             raise HTTPException(400, "Sequence too short")
         
-        result = analyzer.analyze(request.sequence)
+        # The scan is CPU-bound; run it on the threadpool so it doesn't
+        # stall the event loop for every other request
+        result = await run_in_threadpool(analyzer.analyze, request.sequence, request.max_matches_per_pattern)
         result['filename'] = request.filename
         
         return result
@@ -154,15 +216,15 @@ async def analyze_sequence(request: AnalysisRequest):
         raise HTTPException(500, f"Analysis failed: {str(e)}")
 
 @app.post("/api/analyze/file")
-async def analyze_file(file: UploadFile = File(...)):
+async def analyze_file(file: UploadFile = File(...),
+                       max_matches_per_pattern: Optional[int] = Query(None, gt=0)):
     try:
-        content = await file.read()
-        sequence = content.decode('utf-8')
+        sequence = await read_sequence(file)
         
         if not sequence:
             raise HTTPException(400, "Empty file")
         
-        result = analyzer.analyze(sequence)
+        result = await run_in_threadpool(analyzer.analyze, sequence, max_matches_per_pattern)
         result['filename'] = file.filename
         
         return result
@@ -187,4 +249,12 @@ if __name__ == "__main__":
     print("API: http://localhost:8000")
     print("Test: http://localhost:8000/api/test")
     print("Health: http://localhost:8000/health")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Scans hold the GIL, so parallel scans need worker processes;
+    # set WEB_CONCURRENCY to the number of cores to use
+    uvicorn.run(
+        "simple_hgt:app",
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.environ.get("WEB_CONCURRENCY", 1))
+    )
\ No newline at end of file
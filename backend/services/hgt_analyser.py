@@ -1,23 +1,185 @@
 import subprocess
 import json
 import os
+import sys
+import hashlib
+import re
+import bisect
+import glob
+import threading
+import queue
+import selectors
+import signal
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, Iterable, Iterator, List, Tuple
 import tempfile
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import numpy as np
+
+try:
+    # Multi-pattern DFA scanning for known IS signatures
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+# Bytes allowed in FASTA sequence lines: IUPAC nucleotide codes, gaps and
+# line whitespace
+_SEQUENCE_BYTES = np.zeros(256, dtype=bool)
+_SEQUENCE_BYTES[list(b'ACGTUNRYKMSWBDHVacgtunrykmswbdhv-')] = True
+_WHITESPACE_BYTES = np.zeros(256, dtype=bool)
+_WHITESPACE_BYTES[list(b' \t\r\n')] = True
+
+# IUPAC nucleotide complements, for scanning the reverse strand
+_COMPLEMENT = bytes.maketrans(b'ACGTUNRYKMSWBDHVacgtunrykmswbdhv',
+                              b'TGCAANYRMKSWVHDBtgcaanyrmkswvhdb')
+
+# Risk scoring tables: replicon names containing any high-risk family,
+# broad-host-range incompatibility groups, and the bonus for drug class
+# keywords
+_HIGH_RISK_REPLICONS = ('IncF', 'IncI', 'IncA/C', 'IncX', 'IncN')
+_HIGH_RISK_REPLICON_RE = re.compile('|'.join(map(re.escape, _HIGH_RISK_REPLICONS)))
+_BROAD_HOST = frozenset({'IncP', 'IncQ', 'IncW'})
+_HIGH_RISK_DRUGS = {'carbapenem': 15, 'colistin': 20}
+_CARBAPENEM_POINTS = _HIGH_RISK_DRUGS['carbapenem']
+_COLISTIN_POINTS = _HIGH_RISK_DRUGS['colistin']
+
+# Risk level for scores at or above each cutoff
+_RISK_LEVELS = ['Minimal', 'Low', 'Medium', 'High', 'Critical']
+_RISK_CUTOFFS = [10, 30, 50, 70]
+
+def _score_counts(n_plasmids, n_high_risk_replicons, n_broad_host, n_transposons,
+                  n_genes, n_high_risk_genes, n_carbapenem, n_colistin, n_virulence):
+    """HGT risk score (0-100) from per-category element counts"""
+    score = (
+        10 * n_plasmids + 15 * n_high_risk_replicons + 20 * n_broad_host
+        + 5 * n_transposons
+        + 5 * n_genes + 10 * n_high_risk_genes
+        + _CARBAPENEM_POINTS * n_carbapenem + _COLISTIN_POINTS * n_colistin
+        + 3 * n_virulence
+    )
+    return min(score, 100)
+
+# Long-lived RGI process that keeps the package imported between runs
+RGI_WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rgi_worker.py')
+
+# Record id given to a bare sequence; fixed rather than taken from the
+# upload, as cached detections are shared between identical uploads
+_BARE_RECORD_ID = 'sequence'
+
+# Name of the analysis input in its workdir; fixed, so an upload's name
+# can never collide with the other files written there
+_INPUT_FASTA = 'input.fasta'
+
+# Workflow run by the 'snakemake' mode
+SNAKEFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Snakefile')
+
+def _read_fasta(path: str) -> Iterator[Tuple[str, bytes]]:
+    """(record id, sequence bytes) for each record of a FASTA file"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    for record in data.split(b'>')[1:]:
+        header, _, sequence = record.partition(b'\n')
+        yield (header.split() or [b''])[0].decode(), b''.join(sequence.split())
+
+def _parse_blast6(lines: Iterable[bytes]) -> List[Dict]:
+    """Parse BLAST tabular (-outfmt 6) output lines into hit fields
+    
+    Works on the raw bytes: each line is split once, capped at the 12
+    standard columns, and only the kept fields are decoded. Positions are
+    query (contig) coordinates, like the other detectors report.
+    """
+    hits = []
+    for line in lines:
+        parts = line.rstrip(b'\r\n').split(b'\t', 12)
+        if len(parts) >= 12:
+            hits.append({
+                'name': parts[1].decode(),
+                'contig': parts[0].decode(),
+                'position': (parts[6] + b'-' + parts[7]).decode(),
+                'evalue': float(parts[10]),
+                'identity': float(parts[2])
+            })
+    return hits
 
 class HGTRiskAnalyzer:
-    def __init__(self):
-        self.temp_dir = "/tmp/phazegen_hgt"
-        os.makedirs(self.temp_dir, exist_ok=True)
+    def __init__(self, warm_databases: bool = True, mode: str = 'single'):
+        # 'single' drives the tools from Python; 'snakemake' runs them as
+        # the Snakefile workflow, under its core and memory budget
+        if mode not in ('single', 'snakemake'):
+            raise ValueError(f"Unknown mode: {mode}")
+        self.mode = mode
+        self.workflow_mem_mb = 16000
         
         # Initialize databases
         self.db_paths = {
             'card': '/data/db/card',
             'plasmidfinder': '/data/db/plasmidfinder',
             'vfdb': '/data/db/vfdb',
-            'isfinder': '/data/db/isfinder'
+            'isfinder': '/data/db/isfinder',
+            'isfinder_proteins': '/data/db/isfinder.dmnd',
+            'isfinder_signatures': '/data/db/isfinder_signatures.fasta'
         }
+        
+        # DIAMOND replaces blastn for IS detection when it is installed
+        self.diamond = shutil.which('diamond')
+        
+        # Worker threads handed to each external tool. More threads help
+        # most against large databases; with small ones (PlasmidFinder,
+        # ISfinder) setup dominates and extra threads mostly add contention.
+        # The three tools run side by side, so each gets a third of the cores
+        self.cores = os.cpu_count() or 4
+        self.threads = str(max(1, self.cores // 3))
+        
+        # Detected elements of past inputs, keyed by content hash; clear
+        # the directory when the databases are updated
+        self.cache_dir = '/data/cache/hgt'
+        self.cache_size = 512
+        
+        # Hyperscan database of IS signatures, compiled on first use
+        self._is_database = None
+        self._is_names = []
+        self._is_lock = threading.Lock()
+        
+        # Pool of RGI workers, each started on first use; disabled if RGI
+        # can't be imported. A run that doesn't reply within the timeout
+        # (seconds) has its worker killed and is reported as failed
+        self.rgi_workers = 2
+        self.rgi_timeout = 1800
+        self._rgi_idle = queue.Queue()
+        for _ in range(self.rgi_workers):
+            self._rgi_idle.put(None)
+        self._rgi_worker_enabled = True
+        
+        # Stage the databases in the page cache in the background, so the
+        # first analysis after startup doesn't pay for cold reads
+        if warm_databases:
+            threading.Thread(target=self._warm_databases, name='hgt-db-warmup', daemon=True).start()
+    
+    def _warm_databases(self):
+        """Read every database file once to pull it into the page cache"""
+        # Entries are either database directories or BLAST/DIAMOND prefixes
+        # whose files share the name; a prefix can also match other entries
+        # (isfinder* covers isfinder.dmnd), so collect the files first and
+        # read each once
+        files = set()
+        for path in self.db_paths.values():
+            if os.path.isdir(path):
+                files.update(str(p) for p in Path(path).rglob('*') if p.is_file())
+            else:
+                files.update(glob.glob(f"{path}*"))
+        
+        buf = bytearray(1 << 22)
+        for name in sorted(files):
+            try:
+                with open(name, 'rb', buffering=0) as f:
+                    if hasattr(os, 'posix_fadvise'):
+                        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                    while f.readinto(buf):
+                        pass
+            except OSError:
+                continue
     
     def analyze_sequence(self, fasta_content: str, filename: str) -> Dict:
         """Main analysis pipeline"""
@@ -29,18 +191,31 @@ class HGTRiskAnalyzer:
             'warnings': []
         }
         
+        # Each analysis works in its own directory, so concurrent calls
+        # can't clobber or delete each other's files
+        workdir = tempfile.mkdtemp(prefix='phazegen_')
         try:
-            # 1. Save sequence to temp file
-            seq_file = self._save_temp_fasta(fasta_content, filename)
-            
-            # 2. Run assembly (if needed)
-            assembled = self._assemble_if_needed(seq_file)
+            # 1. Validate and save sequence to temp file
+            seq_file, stats = self._save_temp_fasta(fasta_content, workdir)
+            results.update(stats)
             
-            # 3. Run all analyses
-            results['detected_elements']['plasmids'] = self._detect_plasmids(assembled)
-            results['detected_elements']['transposons'] = self._detect_transposons(assembled)
-            results['detected_elements']['resistance_genes'] = self._detect_resistance_genes(assembled)
-            results['detected_elements']['virulence_factors'] = self._detect_virulence(assembled)
+            # Identical uploads reuse the detections of the first run made
+            # with the same tools
+            key = hashlib.blake2b(fasta_content.encode(), digest_size=16,
+                                  key=self._engines().encode()).hexdigest()
+            detected = self._load_cached(key)
+            if detected is None:
+                # 2. Run assembly (if needed)
+                assembled = self._assemble_if_needed(seq_file)
+                
+                # 3. Run all analyses
+                detected, failures = self._run_detectors(assembled, workdir)
+                results['warnings'].extend(failures)
+                # Only complete runs are cached; otherwise a tool failure
+                # would be replayed to every later identical upload
+                if not failures:
+                    self._store_cached(key, detected)
+            results['detected_elements'] = detected
             
             # 4. Calculate risk score
             results['risk_score'] = self._calculate_risk_score(results['detected_elements'])
@@ -49,196 +224,657 @@ class HGTRiskAnalyzer:
             # 5. Generate recommendations
             results['recommendations'] = self._generate_recommendations(results)
             
-            # 6. Clean up
-            self._cleanup_temp_files()
-            
         except Exception as e:
             results['error'] = str(e)
             results['warnings'].append(f"Analysis error: {e}")
             
+        finally:
+            # 6. Clean up
+            shutil.rmtree(workdir, ignore_errors=True)
+            
         return results
     
-    def _detect_plasmids(self, fasta_file: str) -> List[Dict]:
-        """Detect plasmid replicons"""
+    def analyze_batch(self, samples: List[Tuple[str, str]]) -> List[Dict]:
+        """Analyze several (fasta_content, filename) samples with one run per tool
+        
+        Records are tagged ``>{index}|`` in one combined FASTA, so each tool
+        loads its database and starts up once for the whole batch; hits are
+        routed back to their sample by the prefix on the reported contig.
+        """
+        batch = [
+            {
+                'sample_id': filename,
+                'risk_score': 0,
+                'risk_level': 'Low',
+                'detected_elements': {},
+                'warnings': []
+            }
+            for _, filename in samples
+        ]
+        
+        # Validate each sample on its own, so one bad upload only fails
+        # itself and the tools run on the rest
+        records, valid, routes = [], [], {}
+        for index, ((content, filename), results) in enumerate(zip(samples, batch)):
+            try:
+                header, data, stats = self._validate_fasta(content)
+            except ValueError as e:
+                results['error'] = str(e)
+                results['warnings'].append(f"Analysis error: {e}")
+                continue
+            results.update(stats)
+            records.append(self._tag_records((header + data).decode(), index).encode())
+            valid.append(results)
+            routes[str(index)] = results
+        
+        if not valid:
+            return batch
+        
+        workdir = tempfile.mkdtemp(prefix='phazegen_')
+        try:
+            seq_file = self._write_fasta(records, workdir, _INPUT_FASTA)
+            assembled = self._assemble_if_needed(seq_file)
+            
+            detected, failures = self._run_detectors(assembled, workdir)
+            for results in valid:
+                results['warnings'].extend(failures)
+            
+            # Demultiplex the hits by sample. A hit without a tagged contig
+            # can't be attributed, so every sample is told it was left out
+            # rather than its scores silently differing from a single run
+            for key, elements in detected.items():
+                for results in valid:
+                    results['detected_elements'][key] = []
+                unrouted = 0
+                for element in elements:
+                    index, _, contig = element.get('contig', '').partition('|')
+                    if index not in routes:
+                        unrouted += 1
+                        continue
+                    element['contig'] = contig
+                    routes[index]['detected_elements'][key].append(element)
+                if unrouted:
+                    for results in valid:
+                        results['warnings'].append(
+                            f"{unrouted} {key} hits in the batch had no sample contig and were left out"
+                        )
+            
+            scores = self._calculate_risk_scores([results['detected_elements'] for results in valid])
+            for results, score in zip(valid, scores.tolist()):
+                results['risk_score'] = score
+                results['risk_level'] = self._determine_risk_level(results['risk_score'])
+                results['recommendations'] = self._generate_recommendations(results)
+            
+        except Exception as e:
+            for results in valid:
+                results['error'] = str(e)
+                results['warnings'].append(f"Analysis error: {e}")
+        
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        
+        return batch
+    
+    def _load_cached(self, key: str):
+        """Detected elements cached for a content hash, or None"""
+        path = os.path.join(self.cache_dir, f"{key}.json")
+        try:
+            with open(path) as f:
+                detected = json.load(f)
+            # Eviction goes by access time; set it explicitly as the cache
+            # volume may be mounted noatime/relatime
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return detected
+    
+    def _store_cached(self, key: str, detected: Dict):
+        """Cache detected elements, evicting the least recently used entries"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write aside and rename, so readers never see a partial file
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(detected, f)
+            os.replace(temp_path, os.path.join(self.cache_dir, f"{key}.json"))
+            
+            entries = [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith('.json')]
+            if len(entries) > self.cache_size:
+                entries.sort(key=lambda entry: entry.stat().st_atime)
+                for entry in entries[:len(entries) - self.cache_size]:
+                    os.remove(entry.path)
+        except OSError:
+            # Caching is best-effort; a read-only or full volume just
+            # means the next identical upload runs the tools again
+            pass
+    
+    def _engines(self) -> str:
+        """The tools that produce the detections, as part of the cache key"""
+        signatures = hyperscan is not None and os.path.exists(self.db_paths['isfinder_signatures'])
+        proteins = self.diamond and os.path.exists(self.db_paths['isfinder_proteins'])
+        return ','.join([
+            self.mode,
+            'hyperscan' if signatures else '',
+            'diamond' if proteins else 'blastn'
+        ])
+    
+    def _run_detectors(self, fasta_file: str, workdir: str) -> Tuple[Dict[str, List[Dict]], List[str]]:
+        """Run every detector on a FASTA file, writing any outputs to workdir
+        
+        Returns the detected elements and a warning for each tool that
+        failed or was replaced by a fallback.
+        """
+        failures = []
+        if self.mode == 'snakemake':
+            try:
+                return self._run_workflow(fasta_file, workdir), failures
+            except (OSError, subprocess.CalledProcessError) as e:
+                # No snakemake, or a rule failed: run the tools directly
+                failures.append(f"Snakemake workflow failed, ran the tools directly: {e}")
+        
+        # The detectors are independent and spend their time waiting on
+        # external tools, so run them side by side
+        detectors = {
+            'plasmids': partial(self._detect_plasmids, failures=failures),
+            'transposons': partial(self._detect_transposons, workdir=workdir, failures=failures),
+            'resistance_genes': partial(self._detect_resistance_genes, workdir=workdir, failures=failures),
+            'virulence_factors': self._detect_virulence
+        }
+        with ThreadPoolExecutor(max_workers=len(detectors)) as executor:
+            futures = {key: executor.submit(detect, fasta_file) for key, detect in detectors.items()}
+            return {key: future.result() for key, future in futures.items()}, failures
+    
+    def _run_workflow(self, fasta_file: str, workdir: str) -> Dict[str, List[Dict]]:
+        """Run the tools as the Snakemake workflow and parse its outputs"""
+        # Passed as a JSON config file: --config values are parsed as YAML,
+        # which would mangle paths such as 'a: b'
+        config_file = os.path.join(workdir, 'config.json')
+        with open(config_file, 'w') as f:
+            json.dump({
+                'fasta': os.path.abspath(fasta_file),
+                'isfinder': self.db_paths['isfinder'],
+                # Each rule gets the same share of the cores as in the direct
+                # path, so they run side by side rather than one after another
+                'threads': int(self.threads)
+            }, f)
+        
+        cmd = [
+            'snakemake',
+            '--snakefile', SNAKEFILE,
+            '--directory', workdir,
+            '--cores', str(self.cores),
+            '--resources', f"mem_mb={self.workflow_mem_mb}",
+            '--quiet',
+            '--configfile', config_file
+        ]
+        status = self._run_quiet(cmd)
+        if status:
+            raise subprocess.CalledProcessError(status, cmd)
+        
+        outputs = Path(workdir)
+        with (outputs / 'plasmids.tsv').open('rb') as f:
+            plasmids = self._parse_plasmids(f)
+        with (outputs / 'transposons.tsv').open('rb') as f:
+            transposons = self._transposon_entries(_parse_blast6(f))
+        return {
+            'plasmids': plasmids,
+            'transposons': transposons,
+            'resistance_genes': self._parse_rgi(outputs / 'rgi_output.txt'),
+            'virulence_factors': self._detect_virulence(fasta_file)
+        }
+    
+    def _tag_records(self, content: str, index: int) -> str:
+        """Prefix every FASTA header with the sample index for demultiplexing"""
+        lines = content.strip().split('\n')
+        return ''.join(
+            f">{index}|{line[1:]}\n" if line.startswith('>') else f"{line}\n"
+            for line in lines
+        )
+    
+    def _detect_plasmids(self, fasta_file: str, failures: List[str]) -> List[Dict]:
+        """Detect plasmid replicons, noting a fallback in failures"""
         plasmids = []
         
         # Using ABRicate with PlasmidFinder database
         cmd = [
             'abricate', '--db', 'plasmidfinder',
             '--minid', '90', '--mincov', '80',
+            '--threads', self.threads,
             fasta_file
         ]
         
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            lines = result.stdout.strip().split('\n')
-            
-            for line in lines[1:]:  # Skip header
-                if line:
-                    parts = line.split('\t')
-                    if len(parts) >= 8:
-                        plasmid = {
-                            'replicon': parts[5],
-                            'coverage': float(parts[7]),
-                            'identity': float(parts[8]),
-                            'accession': parts[1],
-                            'position': f"{parts[2]}-{parts[3]}"
-                        }
-                        
-                        # Classify plasmid type
-                        plasmid['incompatibility_group'] = self._classify_incompatibility(parts[5])
-                        plasmid['risk_category'] = self._plasmid_risk_category(parts[5])
-                        
-                        plasmids.append(plasmid)
+            plasmids = self._parse_plasmids(self._stream(cmd))
                         
         except subprocess.CalledProcessError as e:
             # Fallback to BLAST if ABRicate fails
+            failures.append(f"ABRicate failed, used fallback plasmid detection: {e}")
             plasmids = self._fallback_plasmid_detection(fasta_file)
             
         return plasmids
     
-    def _detect_transposons(self, fasta_file: str) -> List[Dict]:
-        """Detect transposons and insertion sequences"""
+    def _parse_plasmids(self, lines: Iterable[bytes]) -> List[Dict]:
+        """Plasmid entries from ABRicate PlasmidFinder output lines"""
+        plasmids = []
+        lines = iter(lines)
+        next(lines, None)  # Skip header
+        
+        # Split the rows as bytes, decoding only the kept fields
+        for line in lines:
+            line = line.rstrip(b'\r\n')
+            if line:
+                parts = line.split(b'\t')
+                if len(parts) >= 8:
+                    replicon = parts[5].decode()
+                    sequence_id = parts[1].decode()
+                    plasmid = {
+                        'replicon': replicon,
+                        'coverage': float(parts[7]),
+                        'identity': float(parts[8]),
+                        'accession': sequence_id,
+                        'contig': sequence_id,
+                        'position': (parts[2] + b'-' + parts[3]).decode()
+                    }
+                    
+                    # Classify plasmid type
+                    plasmid['incompatibility_group'] = self._classify_incompatibility(replicon)
+                    plasmid['risk_category'] = self._plasmid_risk_category(replicon)
+                    
+                    plasmids.append(plasmid)
+        
+        return plasmids
+    
+    def _detect_transposons(self, fasta_file: str, workdir: str, failures: List[str]) -> List[Dict]:
+        """Detect transposons and insertion sequences, noting an error in failures"""
         transposons = []
         
+        try:
+            # Known IS signatures take one pass over the sequence; only the
+            # contigs without one go through the alignment search
+            try:
+                hits = self._scan_is_signatures(fasta_file)
+            except Exception as e:
+                failures.append(f"IS signature scan failed, aligned every contig: {e}")
+                hits = []
+            
+            query = fasta_file
+            if hits:
+                matched = {hit['contig'] for hit in hits}
+                records = [
+                    b'>%s\n%s\n' % (contig.encode(), sequence)
+                    for contig, sequence in _read_fasta(fasta_file)
+                    if contig not in matched
+                ]
+                query = self._write_fasta(records, workdir) if records else None
+            
+            if query:
+                hits += _parse_blast6(self._align_is(query))
+            
+            transposons = self._transposon_entries(hits)
+                        
+        except Exception as e:
+            print(f"Transposon detection error: {e}")
+            failures.append(f"Transposon detection error: {e}")
+            
+        return transposons
+    
+    def _align_is(self, fasta_file: str) -> Iterator[bytes]:
+        """BLAST tabular hits against ISfinder, from DIAMOND when it is set up"""
+        if self.diamond and os.path.exists(self.db_paths['isfinder_proteins']):
+            return self._run_diamond(fasta_file, self.db_paths['isfinder_proteins'])
+        
         # Check for transposase genes
         cmd = [
             'blastn', '-query', fasta_file,
             '-db', self.db_paths['isfinder'],
             '-outfmt', '6',
             '-evalue', '1e-10',
-            '-perc_identity', '80'
+            '-perc_identity', '80',
+            '-num_threads', self.threads
         ]
+        return self._stream(cmd)
+    
+    def _transposon_entries(self, hits: List[Dict]) -> List[Dict]:
+        """Transposon entries from IS search hits"""
+        transposons = []
+        for hit in hits:
+            transposon = {'type': 'Insertion Sequence', **hit}
+            
+            # Classify transposon family
+            transposon['family'] = self._classify_transposon_family(hit['name'])
+            transposons.append(transposon)
+        return transposons
+    
+    def _scan_is_signatures(self, fasta_file: str) -> List[Dict]:
+        """Exact IS signature hits on either strand found with Hyperscan
         
-        try:
-            result = subprocess.run(cmd, capture_output=True, text=True)
+        Returns [] when Hyperscan or the signatures aren't set up; positions
+        are forward-strand contig coordinates.
+        """
+        signatures_file = self.db_paths['isfinder_signatures']
+        if hyperscan is None or not os.path.exists(signatures_file):
+            return []
+        
+        hits = []
+        
+        def on_match(signature_id, start, end, flags, context):
+            contig, length, reverse = context
+            if reverse:
+                start, end = length - end, length - start
+            hits.append({
+                'name': self._is_names[signature_id],
+                'contig': contig,
+                'position': f"{start + 1}-{end}",
+                'evalue': 0.0,
+                'identity': 100.0
+            })
+        
+        # Hyperscan's scratch space is shared, so scans are serialized
+        with self._is_lock:
+            if self._is_database is None:
+                records = list(_read_fasta(signatures_file))
+                if not records:
+                    raise ValueError(f"No IS signatures in {signatures_file}")
+                names, signatures = zip(*records)
+                database = hyperscan.Database()
+                database.compile(
+                    expressions=list(signatures),
+                    ids=list(range(len(signatures))),
+                    elements=len(signatures),
+                    flags=hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SOM_LEFTMOST
+                )
+                self._is_names, self._is_database = list(names), database
             
-            for line in result.stdout.split('\n'):
-                if line:
-                    parts = line.split('\t')
-                    if len(parts) >= 12:
-                        transposon = {
-                            'type': 'Insertion Sequence',
-                            'name': parts[1],
-                            'position': f"{parts[8]}-{parts[9]}",
-                            'evalue': float(parts[10]),
-                            'identity': float(parts[2])
-                        }
-                        
-                        # Classify transposon family
-                        transposon['family'] = self._classify_transposon_family(parts[1])
-                        transposons.append(transposon)
-                        
-        except Exception as e:
-            print(f"Transposon detection error: {e}")
+            for contig, sequence in _read_fasta(fasta_file):
+                if sequence:
+                    self._is_database.scan(sequence, match_event_handler=on_match,
+                                           context=(contig, len(sequence), False))
+                    self._is_database.scan(sequence.translate(_COMPLEMENT)[::-1], match_event_handler=on_match,
+                                           context=(contig, len(sequence), True))
+        
+        return hits
+    
+    def _run_diamond(self, fasta_file: str, db: str) -> Iterator[bytes]:
+        """Search translated queries against a DIAMOND protein database
+        
+        Output is BLAST tabular (-outfmt 6), so it parses like blastn's.
+        """
+        cmd = [
+            self.diamond, 'blastx',
+            '-q', fasta_file,
+            '-d', db,
+            '-f', '6',
+            '-e', '1e-10',
+            '--id', '80',
+            '-c1',          # single index chunk: the IS database is small
+            '-g300',        # global ranking caps extensions per query
+            '--threads', self.threads
+        ]
+        return self._stream(cmd)
+    
+    def _stream(self, cmd: List[str]) -> Iterator[bytes]:
+        """Yield a tool's stdout lines as it produces them
+        
+        Parsing overlaps with the tool's run and the output is never held
+        in memory whole. Raises CalledProcessError on a nonzero exit.
+        """
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              bufsize=1 << 20) as process:
+            yield from process.stdout
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, cmd)
+    
+    def _run_quiet(self, cmd: List[str]) -> int:
+        """Run a tool for its output files, discarding stdout/stderr
+        
+        posix_spawnp starts the child without fork()ing this process, so
+        a large server doesn't pay for copying its page tables on every
+        call. Returns the exit status.
+        """
+        if not hasattr(os, 'posix_spawnp'):
+            return subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode
+        
+        file_actions = [
+            (os.POSIX_SPAWN_OPEN, fd, os.devnull, os.O_WRONLY, 0)
+            for fd in (1, 2)
+        ]
+        pid = os.posix_spawnp(cmd[0], cmd, os.environ, file_actions=file_actions)
+        _, status = os.waitpid(pid, 0)
+        return os.waitstatus_to_exitcode(status)
+    
+    def _run_rgi(self, args: List[str]) -> int:
+        """Run ``rgi main`` in an idle long-lived worker, or spawn it if none is free"""
+        if self._rgi_worker_enabled:
+            try:
+                worker = self._rgi_idle.get_nowait()
+            except queue.Empty:
+                # Every worker is busy; spawn rather than wait behind them
+                return self._run_quiet(['rgi', 'main', *args])
             
-        return transposons
+            status = None
+            try:
+                if worker is None or worker.poll() is not None:
+                    worker = self._start_rgi_worker()
+                if worker is not None:
+                    worker.stdin.write(json.dumps({'args': args}) + '\n')
+                    worker.stdin.flush()
+                    reply = self._read_rgi_reply(worker)
+                    if reply:
+                        status = 0 if json.loads(reply).get('ok') else 1
+            except (OSError, ValueError):
+                pass
+            finally:
+                if status is None and worker is not None:
+                    # The worker died or hung mid-run; the slot starts a
+                    # fresh one on its next use
+                    self._kill_rgi_worker(worker)
+                    worker = None
+                self._rgi_idle.put(worker)
+            
+            if status is not None:
+                return status
+        
+        return self._run_quiet(['rgi', 'main', *args])
     
-    def _detect_resistance_genes(self, fasta_file: str) -> List[Dict]:
-        """Detect antibiotic resistance genes"""
+    def _read_rgi_reply(self, worker) -> str:
+        """The worker's next protocol line, '' if it exited
+        
+        Raises TimeoutExpired if nothing arrives within rgi_timeout; the
+        run is not retried, as the same input would likely hang again.
+        """
+        with selectors.DefaultSelector() as selector:
+            selector.register(worker.stdout, selectors.EVENT_READ)
+            if not selector.select(self.rgi_timeout):
+                raise subprocess.TimeoutExpired(worker.args, self.rgi_timeout)
+        return worker.stdout.readline()
+    
+    def _kill_rgi_worker(self, worker):
+        """Kill a worker along with the prodigal/DIAMOND children RGI started"""
+        try:
+            os.killpg(worker.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        worker.wait()
+    
+    def _start_rgi_worker(self):
+        """Start an RGI worker, or disable them if RGI can't be imported"""
+        # In its own session, so the worker and its children can be
+        # killed as one process group
+        worker = subprocess.Popen(
+            [sys.executable, RGI_WORKER],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            text=True, bufsize=1, start_new_session=True
+        )
+        try:
+            if self._read_rgi_reply(worker):
+                return worker
+        except subprocess.TimeoutExpired:
+            pass
+        self._kill_rgi_worker(worker)
+        self._rgi_worker_enabled = False
+        return None
+    
+    def _detect_resistance_genes(self, fasta_file: str, workdir: str, failures: List[str]) -> List[Dict]:
+        """Detect antibiotic resistance genes, noting a failed RGI run in failures"""
         resistance_genes = []
         
         # Use RGI (Resistance Gene Identifier)
-        cmd = [
-            'rgi', 'main',
+        output_prefix = Path(workdir) / 'rgi_output'
+        args = [
             '-i', fasta_file,
-            '-o', os.path.join(self.temp_dir, 'rgi_output'),
+            '-o', str(output_prefix),
             '-t', 'contig',
+            '-n', self.threads,
             '--clean'
         ]
         
         try:
-            subprocess.run(cmd, capture_output=True)
+            status = self._run_rgi(args)
+            rgi_file = output_prefix.with_suffix('.txt')
+            if status or not rgi_file.is_file():
+                failures.append(f"RGI failed with exit status {status}")
             
             # Parse RGI output
-            rgi_file = os.path.join(self.temp_dir, 'rgi_output.txt')
-            if os.path.exists(rgi_file):
-                with open(rgi_file, 'r') as f:
-                    lines = f.readlines()
-                    
-                for line in lines[1:]:  # Skip header
-                    if line.strip():
-                        parts = line.split('\t')
-                        if len(parts) >= 16:
-                            gene = {
-                                'gene': parts[8],
-                                'drug_class': parts[15],
-                                'resistance_mechanism': parts[16] if len(parts) > 16 else '',
-                                'amr_family': parts[9],
-                                'risk_level': self._gene_risk_level(parts[8])
-                            }
-                            resistance_genes.append(gene)
+            resistance_genes = self._parse_rgi(rgi_file)
                             
         except Exception as e:
+            failures.append(f"RGI failed, used ABRicate with CARD: {e}")
             # Fallback to ABRicate with CARD
-            cmd = ['abricate', '--db', 'card', fasta_file]
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            cmd = ['abricate', '--db', 'card', '--threads', self.threads, fasta_file]
+            try:
+                resistance_genes = self._parse_card(self._stream(cmd))
+            except (OSError, subprocess.CalledProcessError) as e:
+                failures.append(f"ABRicate CARD fallback failed: {e}")
             
-            # Parse ABRicate output similarly
-            # ... parsing logic ...
+        return resistance_genes
+    
+    def _parse_card(self, lines: Iterable[bytes]) -> List[Dict]:
+        """Resistance gene entries from ABRicate CARD output lines, shaped like RGI's"""
+        resistance_genes = []
+        lines = iter(lines)
+        next(lines, None)  # Skip header
+        
+        # Split the rows as bytes, decoding only the kept fields
+        for line in lines:
+            parts = line.rstrip(b'\r\n').split(b'\t')
+            if len(parts) >= 15:
+                name = parts[5].decode()
+                gene = {
+                    'gene': name,
+                    'contig': parts[1].decode(),
+                    'drug_class': parts[14].decode(),
+                    'resistance_mechanism': '',
+                    'amr_family': parts[13].decode(),
+                    'risk_level': self._gene_risk_level(name)
+                }
+                resistance_genes.append(gene)
+        
+        return resistance_genes
+    
+    def _parse_rgi(self, rgi_file: Path) -> List[Dict]:
+        """Resistance gene entries from an RGI tab-delimited report"""
+        resistance_genes = []
+        if not rgi_file.is_file():
+            return resistance_genes
+        
+        # Stream the rows as bytes, decoding only the kept fields
+        with rgi_file.open('rb') as f:
+            next(f, None)  # Skip header
             
+            for line in f:
+                parts = line.rstrip(b'\r\n').split(b'\t')
+                if len(parts) >= 16:
+                    name = parts[8].decode()
+                    gene = {
+                        'gene': name,
+                        'contig': parts[1].decode(),
+                        'drug_class': parts[15].decode(),
+                        'resistance_mechanism': parts[16].decode() if len(parts) > 16 else '',
+                        'amr_family': parts[9].decode(),
+                        'risk_level': self._gene_risk_level(name)
+                    }
+                    resistance_genes.append(gene)
+        
         return resistance_genes
     
     def _calculate_risk_score(self, elements: Dict) -> int:
         """Calculate HGT risk score (0-100)"""
-        score = 0
+        plasmids = elements.get('plasmids', [])
+        resistance_genes = elements.get('resistance_genes', [])
+        drug_classes = [gene.get('drug_class', '').lower() for gene in resistance_genes]
+        
+        # Classify in Python, then score the counts
+        return int(_score_counts(
+            len(plasmids),
+            sum(1 for plasmid in plasmids if _HIGH_RISK_REPLICON_RE.search(plasmid.get('replicon', ''))),
+            sum(1 for plasmid in plasmids if plasmid.get('incompatibility_group') in _BROAD_HOST),
+            len(elements.get('transposons', [])),
+            len(resistance_genes),
+            sum(1 for gene in resistance_genes if gene.get('risk_level') == 'High'),
+            sum(1 for drug_class in drug_classes if 'carbapenem' in drug_class),
+            sum(1 for drug_class in drug_classes if 'colistin' in drug_class),
+            len(elements.get('virulence_factors', []))
+        ))
+    
+    def _calculate_risk_scores(self, batch: List[Dict]) -> np.ndarray:
+        """Risk scores for many samples' detected elements at once
+        
+        Same rules as _calculate_risk_score, applied to columns of all the
+        samples' elements with NumPy string and mask operations; per-sample
+        totals come from one bincount per element type.
+        """
+        def column(key, field):
+            values = [element.get(field) or '' for elements in batch for element in elements.get(key, [])]
+            return np.array(values, dtype=str)
+        
+        def owners(key):
+            counts = [len(elements.get(key, [])) for elements in batch]
+            return np.repeat(np.arange(len(batch)), counts)
+        
+        def total(key, points):
+            return np.bincount(owners(key), weights=points, minlength=len(batch))
         
         # Plasmid scoring
-        plasmids = elements.get('plasmids', [])
-        for plasmid in plasmids:
-            score += 10  # Base plasmid score
-            
-            # High-risk plasmids
-            high_risk_replicons = ['IncF', 'IncI', 'IncA/C', 'IncX', 'IncN']
-            if any(hr in plasmid.get('replicon', '') for hr in high_risk_replicons):
-                score += 15
-                
-            # Broad host range
-            if plasmid.get('incompatibility_group') in ['IncP', 'IncQ', 'IncW']:
-                score += 20
+        replicons = column('plasmids', 'replicon')
+        high_risk = np.zeros(replicons.shape, dtype=bool)
+        for replicon in _HIGH_RISK_REPLICONS:
+            high_risk |= np.char.find(replicons, replicon) >= 0
+        broad_host = np.isin(column('plasmids', 'incompatibility_group'), list(_BROAD_HOST))
+        scores = total('plasmids', 10 + 15 * high_risk + 20 * broad_host)
         
-        # Transposon scoring
-        transposons = elements.get('transposons', [])
-        score += len(transposons) * 5
+        # Transposon and virulence factor scoring
+        scores += 5 * total('transposons', None)
+        scores += 3 * total('virulence_factors', None)
         
         # Resistance gene scoring
-        resistance_genes = elements.get('resistance_genes', [])
-        for gene in resistance_genes:
-            score += 5
-            if gene.get('risk_level') == 'High':
-                score += 10
-            if 'carbapenem' in gene.get('drug_class', '').lower():
-                score += 15
-            if 'colistin' in gene.get('drug_class', '').lower():
-                score += 20
-        
-        # Virulence factor scoring
-        virulence = elements.get('virulence_factors', [])
-        score += len(virulence) * 3
-        
-        # Cap score at 100
-        return min(score, 100)
+        drug_classes = np.char.lower(column('resistance_genes', 'drug_class'))
+        points = 5 + 10 * (column('resistance_genes', 'risk_level') == 'High')
+        for keyword, bonus in _HIGH_RISK_DRUGS.items():
+            points = points + bonus * (np.char.find(drug_classes, keyword) >= 0)
+        scores += total('resistance_genes', points)
+        
+        # Cap scores at 100
+        return np.minimum(scores, 100).astype(int)
     
     def _determine_risk_level(self, score: int) -> str:
-        if score >= 70:
-            return 'Critical'
-        elif score >= 50:
-            return 'High'
-        elif score >= 30:
-            return 'Medium'
-        elif score >= 10:
-            return 'Low'
-        else:
-            return 'Minimal'
+        return _RISK_LEVELS[bisect.bisect_right(_RISK_CUTOFFS, score)]
     
     def _generate_recommendations(self, results: Dict) -> List[str]:
         """Generate actionable recommendations based on risk"""
         recommendations = []
         
+        # Every field of every gene, lowercased once, so each keyword check
+        # is one substring search instead of formatting each gene dict
+        genes = ' '.join(
+            str(value)
+            for gene in results['detected_elements'].get('resistance_genes', [])
+            for value in gene.values()
+        ).lower()
+        
         if results['risk_level'] in ['High', 'Critical']:
             recommendations.append("🚨 IMMEDIATE ACTION REQUIRED: High risk of spread detected")
             
-            if any('carbapenem' in str(gene).lower() for gene in results['detected_elements'].get('resistance_genes', [])):
+            if 'carbapenem' in genes:
                 recommendations.append("🔬 Confirm carbapenemase activity with phenotypic testing")
                 
             if len(results['detected_elements'].get('plasmids', [])) > 0:
@@ -253,7 +889,7 @@ class HGTRiskAnalyzer:
             recommendations.append("✅ Routine monitoring sufficient")
             
         # Specific recommendations
-        if any('mcr' in str(gene).lower() for gene in results['detected_elements'].get('resistance_genes', [])):
+        if 'mcr' in genes:
             recommendations.append("💊 Colistin resistance detected - consider alternative therapies")
             
         if len(results['detected_elements'].get('transposons', [])) > 3:
@@ -262,14 +898,70 @@ class HGTRiskAnalyzer:
         return recommendations
     
     # Helper methods
-    def _save_temp_fasta(self, content: str, filename: str) -> str:
-        """Save FASTA content to temporary file"""
-        temp_file = os.path.join(self.temp_dir, f"{filename}_{os.getpid()}.fasta")
-        with open(temp_file, 'w') as f:
-            f.write(content)
-        return temp_file
-    
-    def _cleanup_temp_files(self):
-        """Clean up temporary files"""
-        shutil.rmtree(self.temp_dir, ignore_errors=True)
-        os.makedirs(self.temp_dir, exist_ok=True)
\ No newline at end of file
+    def _save_temp_fasta(self, content: str, workdir: str) -> Tuple[str, Dict]:
+        """Validate FASTA content and save it to a file in the analysis workdir
+        
+        Returns the file path and the record count and sequence length.
+        """
+        header, data, stats = self._validate_fasta(content)
+        return self._write_fasta((header, data), workdir, _INPUT_FASTA), stats
+    
+    def _validate_fasta(self, content: str) -> Tuple[bytes, bytes, Dict]:
+        """Check FASTA content, returning the header to prepend, the data and its stats
+        
+        Raises ValueError for input that isn't nucleotide FASTA; a bare
+        sequence is given a fixed header.
+        """
+        data = content.encode()
+        buf = np.frombuffer(data, dtype=np.uint8)
+        
+        # Vectorized line scan: header lines start with '>' and everything
+        # else is sequence, so no per-line Python strings are created
+        line_starts = np.concatenate(([0], np.flatnonzero(buf == ord('\n')) + 1))
+        line_starts = line_starts[line_starts < buf.size]
+        is_header = buf[line_starts] == ord('>')
+        in_header = np.repeat(is_header, np.diff(line_starts, append=buf.size))
+        
+        sequence = buf[~in_header]
+        residues = ~_WHITESPACE_BYTES[sequence]
+        invalid = np.flatnonzero(residues & ~_SEQUENCE_BYTES[sequence])
+        if invalid.size:
+            raise ValueError(f"Invalid character {chr(sequence[invalid[0]])!r} in sequence")
+        
+        stats = {
+            'record_count': int(np.count_nonzero(is_header)),
+            'sequence_length': int(np.count_nonzero(residues))
+        }
+        if not stats['sequence_length']:
+            raise ValueError("No sequence data in FASTA input")
+        
+        header = b''
+        if not stats['record_count']:
+            header = f">{_BARE_RECORD_ID}\n".encode()
+            stats['record_count'] = 1
+        elif not _WHITESPACE_BYTES[buf[:line_starts[is_header][0]]].all():
+            raise ValueError("Sequence data before the first FASTA header")
+        
+        return header, data, stats
+    
+    def _write_fasta(self, chunks: Iterable[bytes], workdir: str, name: str = None) -> str:
+        """Write encoded FASTA chunks to a new file in the analysis workdir
+        
+        The file gets the given fixed name, or a unique one; names never
+        come from the upload. An existing file is never overwritten.
+        """
+        # Already encoded, so write straight to the descriptor without a
+        # buffered file layer; the input stays private to this user
+        if name is None:
+            fd, temp_file = tempfile.mkstemp(dir=workdir, suffix='.fasta')
+        else:
+            temp_file = os.path.join(workdir, name)
+            fd = os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            for chunk in chunks:
+                view = memoryview(chunk)
+                while view:
+                    view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+        return temp_file
\ No newline at end of file
@@ -0,0 +1,44 @@
+"""Long-lived RGI worker
+
+Imports RGI once and serves ``rgi main`` runs read from stdin, so the
+interpreter start-up and package import are paid once per server instead
+of once per analysis. One JSON object per line:
+
+    request:  {"args": ["-i", "in.fasta", "-o", "out", ...]}
+    response: {"ok": true} or {"ok": false, "error": "..."}
+
+A {"ready": true} line is written once RGI has been imported; the worker
+exits when stdin is closed.
+"""
+import json
+import os
+import sys
+
+
+def main():
+    # Keep stdout for the protocol: anything RGI prints goes to stderr
+    protocol = os.fdopen(os.dup(sys.stdout.fileno()), 'w', buffering=1)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    from app.MainBase import MainBase
+
+    protocol.write(json.dumps({'ready': True}) + '\n')
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+            rgi = MainBase(api=True)
+            rgi.main_run(rgi.main_args().parse_args(request['args']))
+            reply = {'ok': True}
+        except SystemExit as e:
+            # Raised by argparse on bad arguments
+            reply = {'ok': False, 'error': f"rgi exited with status {e.code}"}
+        except Exception as e:
+            reply = {'ok': False, 'error': str(e)}
+        protocol.write(json.dumps(reply) + '\n')
+
+
+if __name__ == '__main__':
+    main()